@@ -1,5 +1,4 @@
 import time
-import json
 
 import pypdfium2 # Needs to be at the top to avoid warnings
 import os
@@ -10,6 +9,7 @@ import argparse
 from marker.convert import convert_single_pdf, convert_single_textract
 from marker.logger import configure_logging
 from marker.models import load_all_models
+from marker.textract.parser import load_textract_json
 
 from marker.output import save_markdown
 
@@ -29,18 +29,18 @@ def main():
 
     langs = args.langs.split(",") if args.langs else None
 
-    model_lst = load_all_models()
-    start = time.time()
-
     if args.textract_json:
-        with open(args.textract_json) as f:
-            textract_data = json.load(f)
+        # Textract conversion doesn't run any models, so skip loading them
+        start = time.time()
+        textract_data = load_textract_json(args.textract_json)
         full_text, images, out_meta = convert_single_textract(
             args.filename,
             textract_data, 
             max_pages=args.max_pages,
         )
     else:
+        model_lst = load_all_models()
+        start = time.time()
         full_text, images, out_meta = convert_single_pdf(
             args.filename,
             model_lst,
@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+
 from marker.schema.merged import MergedLine, MergedBlock, FullyMergedBlock
 from marker.schema.page import Page
 import re
@@ -6,101 +8,129 @@ from typing import List
 
 from marker.settings import settings
 
+# Should cover latin-derived languages and russian
+LOWERCASE_LETTERS = r'\p{Lo}|\p{Ll}|\d'
+ALL_LETTERS = r'\p{L}|\d'
+HYPHENS = r'-—¬'
+SENTENCE_CONTINUATIONS = r',;\(\—\"\'\*'
+SENTENCE_ENDS = ("。", "ๆ", ".", "?", "!")
+
+_TEXT_BLOCKS = frozenset({"Text", "List-item", "Footnote", "Caption", "Figure"})
+_TITLE_BLOCKS = frozenset({"Title", "Section-header"})
+
+# Compiled once at import, since these run for every line pair in the document
+_LEAD_WS_RE = re.compile(r'^(\s*)')
+_TRAIL_WS_RE = re.compile(r'(\s*)$')
+# Only ever run against the last/first few characters of a line, see line_separator
+_HYPHEN_RE = regex.compile(rf'[{LOWERCASE_LETTERS}][{HYPHENS}]\s?$')
+_HYPHEN_START_RE = regex.compile(rf"^\s?[{LOWERCASE_LETTERS}]")
+_HYPHEN_SPLIT_RE = regex.compile(rf"[{HYPHENS}]\s?$")
+_LINE_END_RE = regex.compile(rf'[{LOWERCASE_LETTERS}][{SENTENCE_CONTINUATIONS}]?\s?$')
+_LINE_START_RE = regex.compile(rf'\A\s?[{ALL_LETTERS}]')
+
 
 def escape_markdown(text):
-    # List of characters that need to be escaped in markdown
-    characters_to_escape = r"[#]"
-    # Escape each of these characters with a backslash
-    escaped_text = re.sub(characters_to_escape, r'\\\g<0>', text)
-    return escaped_text
+    # Only # needs escaping, so a plain replace avoids the regex engine
+    return text.replace("#", r"\#")
 
 
 def surround_text(s, char_to_insert):
-    leading_whitespace = re.match(r'^(\s*)', s).group(1)
-    trailing_whitespace = re.search(r'(\s*)$', s).group(1)
+    leading_whitespace = _LEAD_WS_RE.match(s).group(1)
+    trailing_whitespace = _TRAIL_WS_RE.search(s).group(1)
     stripped_string = s.strip()
     modified_string = char_to_insert + stripped_string + char_to_insert
     final_string = leading_whitespace + modified_string + trailing_whitespace
     return final_string
 
 
-def merge_spans(pages: List[Page]) -> List[List[MergedBlock]]:
-    merged_blocks = []
-    for pagenum, page in enumerate(pages):
-        page_num = pagenum + 1
-        page_blocks = []
-        for blocknum, block in enumerate(page.blocks):
-            block_lines = []
-            block_id = block.id
-            for linenum, line in enumerate(block.lines):
-                line_text = ""
-                line_id = line.id
-                if len(line.spans) == 0:
-                    continue
-                fonts = []
-                for i, span in enumerate(line.spans):
-                    font = span.font.lower()
-                    next_span = None
-                    next_idx = 1
-                    while len(line.spans) > i + next_idx:
-                        next_span = line.spans[i + next_idx]
-                        next_idx += 1
-                        if len(next_span.text.strip()) > 2:
-                            break
-
-                    fonts.append(font)
-                    span_text = span.text
-
-                    # Don't bold or italicize very short sequences
-                    # Avoid bolding first and last sequence so lines can be joined properly
-                    if len(span_text) > 3 and 0 < i < len(line.spans) - 1:
-                        if span.italic and (not next_span or not next_span.italic):
-                            span_text = surround_text(span_text, "*")
-                        elif span.bold and (not next_span or not next_span.bold):
-                            span_text = surround_text(span_text, "**")
-                    line_text += span_text
-                line_text += f" [[{page_num}_{block_id}_{line_id}]]"
-
-                # For the last line in the block, add the ID
-                # if linenum == len(block.lines) - 1 and block.id is not None and block.block_type not in ["Code", "Formula"]:
-                #     line_text += f"[[{block.id}]]"
-
-                block_lines.append(MergedLine(
-                    text=line_text,
-                    fonts=fonts,
-                    bbox=line.bbox
-                ))
-            if len(block_lines) > 0:
-                page_blocks.append(MergedBlock(
-                    lines=block_lines,
-                    pnum=page.pnum,
-                    bbox=block.bbox,
-                    block_type=block.block_type,
-                    heading_level=block.heading_level,
-                    id=block.id
-                ))
-        if len(page_blocks) == 0:
-            page_blocks.append(MergedBlock(
-                lines=[],
+def merge_page_spans(page: Page, pagenum: int) -> List[MergedBlock]:
+    page_num = pagenum + 1
+    page_blocks = []
+    for blocknum, block in enumerate(page.blocks):
+        block_lines = []
+        block_id = block.id
+        for linenum, line in enumerate(block.lines):
+            line_id = line.id
+            n = len(line.spans)
+            if n == 0:
+                continue
+
+            # Next span with more than 2 non-whitespace chars, falling back to the last span in the line
+            next_spans = [None] * n
+            for j in range(n - 2, -1, -1):
+                candidate = line.spans[j + 1]
+                if len(candidate.text.strip()) > 2 or next_spans[j + 1] is None:
+                    next_spans[j] = candidate
+                else:
+                    next_spans[j] = next_spans[j + 1]
+
+            fonts = []
+            parts = []
+            last_idx = n - 1
+            for i, span in enumerate(line.spans):
+                fonts.append(span.font.lower())
+                span_text = span.text
+
+                # Don't bold or italicize very short sequences
+                # Avoid bolding first and last sequence so lines can be joined properly
+                if 0 < i < last_idx and len(span_text) > 3:
+                    next_span = next_spans[i]
+                    if span.italic and (not next_span or not next_span.italic):
+                        span_text = surround_text(span_text, "*")
+                    elif span.bold and (not next_span or not next_span.bold):
+                        span_text = surround_text(span_text, "**")
+                parts.append(span_text)
+            parts.append(f" [[{page_num}_{block_id}_{line_id}]]")
+            line_text = "".join(parts)
+
+            # For the last line in the block, add the ID
+            # if linenum == len(block.lines) - 1 and block.id is not None and block.block_type not in ["Code", "Formula"]:
+            #     line_text += f"[[{block.id}]]"
+
+            block_lines.append(MergedLine.model_construct(
+                text=line_text,
+                fonts=fonts,
+                bbox=line.bbox
+            ))
+        if len(block_lines) > 0:
+            page_blocks.append(MergedBlock.model_construct(
+                lines=block_lines,
                 pnum=page.pnum,
-                bbox=page.bbox,
-                block_type="Text",
-                heading_level=None,
-                id=None
+                bbox=block.bbox,
+                block_type=block.block_type,
+                heading_level=block.heading_level,
+                id=block.id
             ))
-        merged_blocks.append(page_blocks)
+    if len(page_blocks) == 0:
+        page_blocks.append(MergedBlock.model_construct(
+            lines=[],
+            pnum=page.pnum,
+            bbox=page.bbox,
+            block_type="Text",
+            heading_level=None,
+            id=None
+        ))
+    return page_blocks
+
 
-    return merged_blocks
+def merge_spans(pages: List[Page]) -> List[List[MergedBlock]]:
+    # Pages are independent, so they can be merged in parallel.  Serial by default, since each page
+    # has to be pickled to a worker, and the daemonic workers in convert.py can't spawn processes
+    if settings.MARKDOWN_MERGE_CPU_WORKERS > 1 and len(pages) > 1:
+        with ProcessPoolExecutor(max_workers=settings.MARKDOWN_MERGE_CPU_WORKERS) as executor:
+            return list(executor.map(merge_page_spans, pages, range(len(pages))))
+
+    return [merge_page_spans(page, pagenum) for pagenum, page in enumerate(pages)]
 
 
 def block_surround(text, block_type, heading_level, block_id=None):  # Add block_id parameter
     if block_type == "Section-header":
         if not text.startswith("#"):
             asterisks = "#" * heading_level if heading_level is not None else "##"
-            text = f"\n{asterisks} " + text.strip().title() + "\n"
+            text = f"\n{asterisks} {text.strip().title()}\n"
     elif block_type == "Title":
         if not text.startswith("#"):
-            text = "# " + text.strip().title() + "\n"
+            text = f"# {text.strip().title()}\n"
     elif block_type == "Table":
         text = "\n" + text + "\n"
     elif block_type == "List-item":
@@ -119,33 +149,22 @@ def block_surround(text, block_type, heading_level, block_id=None):  # Add block
 
 
 def line_separator(line1, line2, block_type, is_continuation=False):
-    # Should cover latin-derived languages and russian
-    lowercase_letters = r'\p{Lo}|\p{Ll}|\d'
-    hyphens = r'-—¬'
     # Remove hyphen in current line if next line and current line appear to be joined
-    hyphen_pattern = regex.compile(rf'.*[{lowercase_letters}][{hyphens}]\s?$', regex.DOTALL)
-    if line1 and hyphen_pattern.match(line1) and regex.match(rf"^\s?[{lowercase_letters}]", line2):
+    # line1 is the whole block so far, so only look at its tail
+    if line1 and _HYPHEN_RE.search(line1[-4:]) and _HYPHEN_START_RE.match(line2[:4]):
         # Split on — or - from the right
-        line1 = regex.split(rf"[{hyphens}]\s?$", line1)[0]
+        line1 = line1[:-4] + _HYPHEN_SPLIT_RE.split(line1[-4:])[0]
         return line1.rstrip() + line2.lstrip()
 
-    all_letters = r'\p{L}|\d'
-    sentence_continuations = r',;\(\—\"\'\*'
-    sentence_ends = r'。ๆ\.?!'
-    line_end_pattern = regex.compile(rf'.*[{lowercase_letters}][{sentence_continuations}]?\s?$', regex.DOTALL)
-    line_start_pattern = regex.compile(rf'^\s?[{all_letters}]', regex.DOTALL)
-    sentence_end_pattern = regex.compile(rf'.*[{sentence_ends}]\s?$', regex.DOTALL)
-
-    text_blocks = ["Text", "List-item", "Footnote", "Caption", "Figure"]
-    if block_type in ["Title", "Section-header"]:
+    if block_type in _TITLE_BLOCKS:
         return line1.rstrip() + " " + line2.lstrip()
     elif block_type == "Formula":
         return line1 + "\n" + line2
-    elif line_end_pattern.match(line1) and line_start_pattern.match(line2) and block_type in text_blocks:
+    elif block_type in _TEXT_BLOCKS and _LINE_END_RE.search(line1[-4:]) and _LINE_START_RE.search(line2[:4]):
         return line1.rstrip() + " " + line2.lstrip()
     elif is_continuation:
         return line1.rstrip() + " " + line2.lstrip()
-    elif block_type in text_blocks and sentence_end_pattern.match(line1):
+    elif block_type in _TEXT_BLOCKS and line1.rstrip().endswith(SENTENCE_ENDS):
         return line1 + "\n\n" + line2
     elif block_type == "Table":
         return line1 + "\n\n" + line2
@@ -161,10 +180,10 @@ def block_separator(prev_block: FullyMergedBlock, block: FullyMergedBlock):
     return sep + block.text
 
 
-def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
+def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15, continuation_tol=0.5):
     text_blocks = []
     prev_type = None
-    prev_line = None
+    prev_x0 = prev_y0 = prev_y1 = prev_height = None
     block_text = ""
     block_type = ""
     prev_heading_level = None
@@ -176,7 +195,7 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
         if settings.PAGINATE_OUTPUT:
             if block_text:
                 text_blocks.append(
-                    FullyMergedBlock(
+                    FullyMergedBlock.model_construct(
                         text=block_surround(block_text, prev_type, prev_heading_level, curr_block_id),
                         block_type=prev_type if prev_type else settings.DEFAULT_BLOCK_TYPE,
                         page_start=False,
@@ -186,7 +205,7 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
                 )
                 block_text = ""
             text_blocks.append(
-                FullyMergedBlock(
+                FullyMergedBlock.model_construct(
                     text="",
                     block_type="Text",
                     page_start=True,
@@ -199,7 +218,7 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
             curr_block_id = block.id
             if (block_type != prev_type and prev_type) or (block.heading_level != prev_heading_level and prev_heading_level):
                 text_blocks.append(
-                    FullyMergedBlock(
+                    FullyMergedBlock.model_construct(
                         text=block_surround(block_text, prev_type, prev_heading_level, curr_block_id),
                         block_type=prev_type if prev_type else settings.DEFAULT_BLOCK_TYPE,
                         page_start=False,
@@ -214,12 +233,16 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
             pnum = block.pnum
             # Join lines in the block together properly
             for i, line in enumerate(block.lines):
-                line_height = line.bbox[3] - line.bbox[1]
-                prev_line_height = prev_line.bbox[3] - prev_line.bbox[1] if prev_line else 0
-                prev_line_x = prev_line.bbox[0] if prev_line else 0
-                vertical_dist = min(abs(line.bbox[1] - prev_line.bbox[3]), abs(line.bbox[3] - prev_line.bbox[1])) if prev_line else 0
-                prev_line = line
-                is_continuation = line_height == prev_line_height and line.bbox[0] == prev_line_x and vertical_dist < max_block_gap
+                x0, y0, x1, y1 = line.bbox
+                line_height = y1 - y0
+                # Same height and left edge as the previous line (within tolerance), and vertically close to it
+                is_continuation = (
+                    prev_height is not None
+                    and abs(line_height - prev_height) < continuation_tol
+                    and abs(x0 - prev_x0) < continuation_tol
+                    and min(abs(y0 - prev_y1), abs(y1 - prev_y0)) < max_block_gap
+                )
+                prev_x0, prev_y0, prev_y1, prev_height = x0, y0, y1, line_height
                 if block_text:
                     block_text = line_separator(block_text, line.text, block_type, is_continuation)
                 else:
@@ -227,7 +250,7 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
 
     # Append the final block
     text_blocks.append(
-        FullyMergedBlock(
+        FullyMergedBlock.model_construct(
             text=block_surround(block_text, prev_type, prev_heading_level, curr_block_id),
             block_type=block_type if block_type else settings.DEFAULT_BLOCK_TYPE,
             page_start=False,
@@ -241,14 +264,14 @@ def merge_lines(blocks: List[List[MergedBlock]], max_block_gap=15):
 
 
 def get_full_text(text_blocks):
-    full_text = ""
+    parts = []
     prev_block = None
     for block in text_blocks:
         if block.page_start:
-            full_text += "\n\n{" + str(block.pnum) + "}" + settings.PAGE_SEPARATOR
+            parts.append("\n\n{" + str(block.pnum) + "}" + settings.PAGE_SEPARATOR)
         elif prev_block:
-            full_text += block_separator(prev_block, block)
+            parts.append(block_separator(prev_block, block))
         else:
-            full_text += block.text
+            parts.append(block.text)
         prev_block = block
-    return full_text
+    return "".join(parts)
@@ -89,6 +89,7 @@ class Settings(BaseSettings):
     HEADING_DEFAULT_LEVEL: int = 2
 
     # Output
+    MARKDOWN_MERGE_CPU_WORKERS: int = 1 # How many CPU workers to use for merging spans into markdown, 1 processes pages serially
     PAGE_SEPARATOR: str = "-" * 48 + "\n\n"
 
     # Debug
@@ -1,4 +1,14 @@
-from typing import List, Dict, Any, Optional
+import json
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from marker.schema.block import Block, Line, Span
 from marker.schema.page import Page
 
@@ -7,6 +17,18 @@ from tabled.schema import SpanTableCell
 
 from surya.schema import TextDetectionResult, LayoutResult, OrderResult, LayoutBox
 
+# Pulls (Left, Top, Width, Height) out of a Textract BoundingBox in one C-level call
+_BBOX_GET = itemgetter("Left", "Top", "Width", "Height")
+
+def load_textract_json(path: str) -> Dict[str, Any]:
+    """Load a Textract JSON file, using orjson when it is installed since these files can be very large"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    
+    with open(path) as f:
+        return json.load(f)
+
 def convert_bbox(textract_bbox: Dict[str, float], page_width: int, page_height: int) -> List[float]:
     """
     Convert Textract BoundingBox format (normalized 0-1) to absolute pixel coordinates
@@ -19,20 +41,45 @@ def convert_bbox(textract_bbox: Dict[str, float], page_width: int, page_height:
     Returns:
         List[float]: [x0, y0, x1, y1] in absolute pixel coordinates
     """
-    x0 = textract_bbox["Left"] * page_width
-    y0 = textract_bbox["Top"] * page_height
-    width = textract_bbox["Width"] * page_width
-    height = textract_bbox["Height"] * page_height
+    left, top, width, height = _BBOX_GET(textract_bbox)
+    return [left * page_width, top * page_height, (left + width) * page_width, (top + height) * page_height]
+
+def convert_bboxes(textract_bboxes: List[Sequence[float]], page_width: int, page_height: int) -> List[List[float]]:
+    """
+    Vectorized version of convert_bbox
     
-    x1 = x0 + width
-    y1 = y0 + height
+    Args:
+        textract_bboxes: List of (Left, Top, Width, Height) in 0-1 range
+        page_width: Width of the page in pixels
+        page_height: Height of the page in pixels
     
-    return [x0, y0, x1, y1]
+    Returns:
+        List[List[float]]: [x0, y0, x1, y1] in absolute pixel coordinates for each bbox
+    """
+    if not textract_bboxes:
+        return []
+    
+    # float64, with the same operation order as convert_bbox, so results match it exactly
+    bboxes = np.array(textract_bboxes, dtype=np.float64)
+    bboxes[:, 2:] += bboxes[:, :2]
+    bboxes *= np.array([page_width, page_height, page_width, page_height], dtype=np.float64)
+    return bboxes.tolist()
 
-def process_text_block(block: Dict, blocks_by_id: Dict[str, Dict], page_width: int, page_height: int) -> Block:
+def get_block_bbox(block: Dict, page_width: int, page_height: int, bbox_cache: Optional[Dict[str, List[float]]] = None) -> List[float]:
+    """Convert a block's bbox, reusing the converted bbox from bbox_cache (keyed by block Id) when available"""
+    if bbox_cache is None:
+        return convert_bbox(block["Geometry"]["BoundingBox"], page_width, page_height)
+    
+    bbox = bbox_cache.get(block["Id"])
+    if bbox is None:
+        bbox = convert_bbox(block["Geometry"]["BoundingBox"], page_width, page_height)
+        bbox_cache[block["Id"]] = bbox
+    return bbox
+
+def process_text_block(block: Dict, blocks_by_id: Dict[str, Dict], page_width: int, page_height: int, bbox_cache: Optional[Dict[str, List[float]]] = None) -> Block:
     """Convert a LINE block to our Block format"""
     # Convert bbox
-    bbox = convert_bbox(block["Geometry"]["BoundingBox"], page_width, page_height)
+    bbox = get_block_bbox(block, page_width, page_height, bbox_cache)
     
     # Create span with the text content
     span = Span(
@@ -60,24 +107,23 @@ def process_text_block(block: Dict, blocks_by_id: Dict[str, Dict], page_width: i
     
     return text_block
 
-def merge_line_blocks_with_cells(blocks_by_id: Dict[str, Dict]) -> Dict[str, Dict]:
+def merge_line_blocks_with_cells(blocks_by_id: Dict[str, Dict], line_blocks: List[Dict], cell_blocks: List[Dict]) -> Dict[str, Dict]:
     """Process CELL blocks and remove LINE blocks that overlap with cells"""
     
     # Track which LINE blocks to remove
     lines_to_remove = set()
     
-    # First find all LINE and CELL blocks
-    line_blocks = {
-        block_id: block 
-        for block_id, block in blocks_by_id.items() 
-        if block["BlockType"] == "LINE"
-    }
+    # Index the LINE and CELL blocks by ID
+    line_blocks = {block["Id"]: block for block in line_blocks}
+    cell_blocks = {block["Id"]: block for block in cell_blocks}
     
-    cell_blocks = {
-        block_id: block 
-        for block_id, block in blocks_by_id.items() 
-        if block["BlockType"] == "CELL"
-    }
+    # Map each child (WORD block) to the LINE block containing it
+    word_to_line: Dict[str, str] = {}
+    for line_id, line in line_blocks.items():
+        for relationship in line.get("Relationships", []):
+            if relationship["Type"] == "CHILD":
+                for word_id in relationship["Ids"]:
+                    word_to_line[word_id] = line_id
     
     # For each CELL block, check if any LINE blocks have overlapping children
     for cell_id, cell in cell_blocks.items():
@@ -87,16 +133,8 @@ def merge_line_blocks_with_cells(blocks_by_id: Dict[str, Dict]) -> Dict[str, Dic
             if relationship["Type"] == "CHILD":
                 cell_children.update(relationship["Ids"])
         
-        # Remove any LINE blocks that have overlapping children with this cell
-        for line_id, line in line_blocks.items():
-            line_children = set()
-            for relationship in line.get("Relationships", []):
-                if relationship["Type"] == "CHILD":
-                    line_children.update(relationship["Ids"])
-            
-            # If there's any overlap between children, mark line for removal
-            if line_children & cell_children:  # Using set intersection
-                lines_to_remove.add(line_id)
+        # Remove any LINE blocks that share children with this cell
+        lines_to_remove.update(word_to_line[w] for w in cell_children if w in word_to_line)
         
         # Get text from WORD blocks in order of cell's children
         cell_text = []
@@ -123,11 +161,11 @@ def merge_line_blocks_with_cells(blocks_by_id: Dict[str, Dict]) -> Dict[str, Dic
         
     return blocks_by_id
 
-def process_table(block: Dict, blocks_by_id: Dict[str, Dict], page_width: int, page_height: int) -> Block:
+def process_table(block: Dict, blocks_by_id: Dict[str, Dict], page_width: int, page_height: int, bbox_cache: Optional[Dict[str, List[float]]] = None) -> Block:
     """Convert a TABLE block and its cells to a markdown Block"""
     
     # Get table bbox
-    table_bbox = convert_bbox(block["Geometry"]["BoundingBox"], page_width, page_height)
+    table_bbox = get_block_bbox(block, page_width, page_height, bbox_cache)
     
     # Get all cell blocks from relationships
     cells = []
@@ -138,7 +176,7 @@ def process_table(block: Dict, blocks_by_id: Dict[str, Dict], page_width: int, p
                     cell_block = blocks_by_id.get(cell_id)
                     if cell_block and cell_block["BlockType"] == "CELL":
                         # Convert cell bbox
-                        cell_bbox = convert_bbox(cell_block["Geometry"]["BoundingBox"], page_width, page_height)
+                        cell_bbox = get_block_bbox(cell_block, page_width, page_height, bbox_cache)
                         
                         # Create SpanTableCell
                         cell = SpanTableCell(
@@ -185,28 +223,24 @@ def reorder_blocks_by_position(blocks: List[Block]) -> List[Block]:
     table_blocks = [b for b in blocks if b.block_type == "Table"]
     text_blocks = [b for b in blocks if b.block_type != "Table"]
     
-    # Sort text blocks by vertical position
+    # Sort both groups by vertical position
     text_blocks.sort(key=lambda b: b.bbox[1])  # Sort by y-coordinate (top)
+    table_blocks.sort(key=lambda b: b.bbox[1])
     
-    # For each table block, find where it should be inserted
+    # Merge the two sorted lists, placing a table before a text block if its top is above the text block's top
     reordered_blocks = []
-    remaining_tables = table_blocks.copy()
-    
-    for i, text_block in enumerate(text_blocks):
-        # Add any tables that should come before this text block
-        while remaining_tables:
-            table = remaining_tables[0]
-            # If table's top is before current text block's top
-            if table.bbox[1] < text_block.bbox[1]:
-                reordered_blocks.append(table)
-                remaining_tables.pop(0)
-            else:
-                break
-                
-        reordered_blocks.append(text_block)
-    
-    # Add any remaining tables at the end
-    reordered_blocks.extend(remaining_tables)
+    table_idx = text_idx = 0
+    while table_idx < len(table_blocks) and text_idx < len(text_blocks):
+        if table_blocks[table_idx].bbox[1] < text_blocks[text_idx].bbox[1]:
+            reordered_blocks.append(table_blocks[table_idx])
+            table_idx += 1
+        else:
+            reordered_blocks.append(text_blocks[text_idx])
+            text_idx += 1
+    
+    # Add whatever is left over at the end
+    reordered_blocks.extend(text_blocks[text_idx:])
+    reordered_blocks.extend(table_blocks[table_idx:])
     
     return reordered_blocks
 
@@ -216,69 +250,73 @@ def parse_textract_json(json_data: Dict[str, Any], page_width: int = 1000, page_
     # Initialize storage
     pages: Dict[int, Page] = {}  # Store pages by page number
     blocks_by_id: Dict[str, Dict] = {}  # Store blocks by ID for relationship lookup
-    table_counter = 0
-    
-    # First pass: Store all blocks by ID and initialize pages with layout
+    bbox_cache: Dict[str, List[float]] = {}  # Store converted bboxes by ID
+    layout_blocks: List[Dict] = []
+    line_blocks: List[Dict] = []
+    table_blocks: List[Dict] = []
+    cell_blocks: List[Dict] = []
+    content_blocks: List[Dict] = []  # LINE and TABLE blocks, in document order
+    page_nums = set()
+    bbox_ids: List[str] = []  # IDs of blocks whose bboxes we will need, converted in bulk below
+    textract_bboxes: List[Sequence[float]] = []
+    
+    # Single pass over the JSON: index blocks by ID and partition them by type
     for block in json_data["Blocks"]:
         blocks_by_id[block["Id"]] = block
+        page_nums.add(block["Page"] - 1)  # Textract is 1-indexed
         
-        if "LAYOUT" in block["BlockType"]:
-            # Get page number (Textract is 1-indexed)
-            page_num = block["Page"] - 1
-            
-            # Create page if it doesn't exist
-            if page_num not in pages:
-                pages[page_num] = Page(
-                    pnum=page_num,
-                    blocks=[],
-                    bbox=[0, 0, page_width, page_height],
-                    ocr_method="textract",
-                    layout=LayoutResult(
-                        bboxes=[],
-                        segmentation_map=None,
-                        image_bbox=[0, 0, page_width, page_height]
-                    )
-                )
-            
-            # Convert bbox and create LayoutBox
-            bbox = convert_bbox(block["Geometry"]["BoundingBox"], page_width, page_height)
-            layout_box = LayoutBox(
-                polygon=[[bbox[0], bbox[1]], [bbox[2], bbox[1]], 
-                        [bbox[2], bbox[3]], [bbox[0], bbox[3]]],
-                label=block["BlockType"].lower()
-            )
-            
-            # Add to page's layout bboxes
-            pages[page_num].layout.bboxes.append(layout_box)
-    
-    # Process tables first and number their cells
-    for block in json_data["Blocks"]:
-        if block["BlockType"] == "TABLE":
-            # Add table number to all child cells
-            if "Relationships" in block:
-                for relationship in block["Relationships"]:
-                    if relationship["Type"] == "CHILD":
-                        for cell_id in relationship["Ids"]:
-                            if cell_id in blocks_by_id and blocks_by_id[cell_id]["BlockType"] == "CELL":
-                                blocks_by_id[cell_id]["TableNumber"] = table_counter
-            table_counter += 1
-    
-    # Merge LINE blocks into their parent CELL blocks
-    blocks_by_id = merge_line_blocks_with_cells(blocks_by_id)
-    
-    # Reset table counter for block processing
-    table_counter = 0
-        
-    # Process blocks into Pages
-    for block in json_data["Blocks"]:
-        # Skip blocks that were merged into cells
-        if block["Id"] not in blocks_by_id:
+        block_type = block["BlockType"]
+        if "LAYOUT" in block_type:
+            layout_blocks.append(block)
+        elif block_type == "LINE":
+            line_blocks.append(block)
+            content_blocks.append(block)
+        elif block_type == "TABLE":
+            table_blocks.append(block)
+            content_blocks.append(block)
+        elif block_type == "CELL":
+            cell_blocks.append(block)
+        else:
+            # WORD, PAGE, etc. are only looked up through blocks_by_id and never need a bbox
             continue
-            
-        # Get page number (Textract is 1-indexed)
+        
+        bbox_ids.append(block["Id"])
+        textract_bboxes.append(_BBOX_GET(block["Geometry"]["BoundingBox"]))
+    
+    # Convert all needed bboxes at once
+    bbox_cache.update(zip(bbox_ids, convert_bboxes(textract_bboxes, page_width, page_height)))
+    
+    # Initialize pages with layout
+    for block in layout_blocks:
         page_num = block["Page"] - 1
         
         # Create page if it doesn't exist
+        if page_num not in pages:
+            pages[page_num] = Page(
+                pnum=page_num,
+                blocks=[],
+                bbox=[0, 0, page_width, page_height],
+                ocr_method="textract",
+                layout=LayoutResult(
+                    bboxes=[],
+                    segmentation_map=None,
+                    image_bbox=[0, 0, page_width, page_height]
+                )
+            )
+        
+        # Convert bbox and create LayoutBox
+        bbox = get_block_bbox(block, page_width, page_height, bbox_cache)
+        layout_box = LayoutBox(
+            polygon=[[bbox[0], bbox[1]], [bbox[2], bbox[1]], 
+                    [bbox[2], bbox[3]], [bbox[0], bbox[3]]],
+            label=block["BlockType"].lower()
+        )
+        
+        # Add to page's layout bboxes
+        pages[page_num].layout.bboxes.append(layout_box)
+    
+    # Create any pages without layout information
+    for page_num in page_nums:
         if page_num not in pages:
             pages[page_num] = Page(
                 pnum=page_num,
@@ -286,18 +324,32 @@ def parse_textract_json(json_data: Dict[str, Any], page_width: int = 1000, page_
                 bbox=[0, 0, page_width, page_height],
                 ocr_method="textract"
             )
-            
-        # Process based on block type
+    
+    # Number the cells of each table. Only the partitioned TABLE blocks are walked, since cells
+    # can come after their table in the JSON and so can't be stamped during the partition pass
+    for table_number, block in enumerate(table_blocks):
+        for relationship in block.get("Relationships", []):
+            if relationship["Type"] == "CHILD":
+                for cell_id in relationship["Ids"]:
+                    cell_block = blocks_by_id.get(cell_id)
+                    if cell_block is not None and cell_block["BlockType"] == "CELL":
+                        cell_block["TableNumber"] = table_number
+    
+    # Merge LINE blocks into their parent CELL blocks, if there are any cells
+    if cell_blocks:
+        blocks_by_id = merge_line_blocks_with_cells(blocks_by_id, line_blocks, cell_blocks)
+    
+    # Process blocks into Pages, in document order so block and line IDs are assigned in that order
+    for block in content_blocks:
+        # Skip blocks that were merged into cells
+        if block["Id"] not in blocks_by_id:
+            continue
+        
         if block["BlockType"] == "LINE":
-            processed_block = process_text_block(block, blocks_by_id, page_width, page_height)
-        elif block["BlockType"] == "TABLE":
-            processed_block = process_table(block, blocks_by_id, page_width, page_height)
-            table_counter += 1
+            processed_block = process_text_block(block, blocks_by_id, page_width, page_height, bbox_cache)
         else:
-            continue
-            
-        # Add block to page
-        pages[page_num].blocks.append(processed_block)
+            processed_block = process_table(block, blocks_by_id, page_width, page_height, bbox_cache)
+        pages[block["Page"] - 1].blocks.append(processed_block)
     
     # Convert dict to list and sort by page number
     pages_list = [pages[i] for i in sorted(pages.keys())]
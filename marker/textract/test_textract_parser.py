@@ -1,11 +1,10 @@
-import json
 import argparse
 from pathlib import Path
 import pypdfium2 as pdfium
 import os
 
 from marker.convert import convert_single_pdf, convert_single_textract
-from marker.textract.parser import parse_textract_json, process_text_block, process_table
+from marker.textract.parser import parse_textract_json, process_text_block, process_table, load_textract_json
 
 from marker.output import save_markdown
 
@@ -19,8 +18,7 @@ def main():
     args = parser.parse_args()
 
     # Load the Textract JSON
-    with open(args.textract_json) as f:
-        textract_data = json.load(f)
+    textract_data = load_textract_json(args.textract_json)
 
     
     full_text, images, out_meta = convert_single_textract(